@@ -1,8 +1,10 @@
 from flask import Flask, render_template, request, redirect, url_for, jsonify, flash
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
-from datetime import datetime
+from datetime import datetime, timedelta
 import os
+import heapq
+import threading
 import requests
 import pytz
 from jira import JIRA
@@ -21,6 +23,20 @@ migrate = Migrate(app, db)
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
+# SLA targets per ticket priority, measured from the start of the ticket's SLA clock
+SLA_POLICIES = {
+    'Urgent': {'first_response': timedelta(hours=1), 'resolution': timedelta(hours=4)},
+    'High': {'first_response': timedelta(hours=4), 'resolution': timedelta(days=1)},
+    'Medium': {'first_response': timedelta(hours=8), 'resolution': timedelta(days=3)},
+    'Low': {'first_response': timedelta(days=1), 'resolution': timedelta(days=5)},
+}
+# Priority a ticket is bumped to when its resolution SLA is breached
+PRIORITY_ESCALATION = {'Low': 'Medium', 'Medium': 'High', 'High': 'Urgent'}
+SLA_BATCH_SIZE = 100  # Max breached tickets escalated per database commit
+SLA_LOAD_WINDOW = timedelta(hours=1)  # How far ahead deadlines are held in memory
+SLA_RETRY_DELAY = timedelta(minutes=1)
+SLACK_TIMEOUT = 10  # Seconds to wait on a Slack webhook
+
 class Ticket(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(100), nullable=False)
@@ -35,6 +51,9 @@ class Ticket(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     deleted = db.Column(db.Boolean, default=False)  # New column for soft delete
     jira_issue_key = db.Column(db.String(20))  # New column for JIRA issue key
+    sla_stage = db.Column(db.String(20))  # 'first_response', 'resolution', 'breached' or 'closed'
+    sla_started_at = db.Column(db.DateTime)  # Start of the SLA clock: creation, or the latest reopen
+    sla_due_at = db.Column(db.DateTime, index=True)  # Next SLA deadline, NULL when nothing is pending
 
     def to_dict(self):
         # Assume UTC timezone for stored dates
@@ -59,7 +78,9 @@ class Ticket(db.Model):
             'created_at_iso': self.created_at.isoformat(),
             'updated_at_iso': self.updated_at.isoformat(),
             'jira_issue_key': self.jira_issue_key,
-            'jira_issue_url': self.get_jira_issue_url()
+            'jira_issue_url': self.get_jira_issue_url(),
+            'sla_stage': self.sla_stage,
+            'sla_due_at_iso': self.sla_due_at.isoformat() if self.sla_due_at else None
         }
 
     def get_jira_issue_url(self):
@@ -68,6 +89,47 @@ class Ticket(db.Model):
             return f"{jira_settings['server']}/browse/{self.jira_issue_key}"
         return None
 
+    def update_sla(self, now=None):
+        # Recompute the pending SLA deadline from the current status and priority
+        now = now or datetime.utcnow()
+        if self.sla_stage == 'breached':
+            return  # A missed resolution SLA is final, even across close and reopen
+        if self.deleted or self.status == 'Closed':
+            self.sla_stage = 'closed'
+            self.sla_due_at = None
+            return
+
+        if self.sla_stage == 'closed':
+            # Reopened tickets get a fresh resolution clock from the reopen time
+            self.sla_stage = 'resolution'
+            self.sla_started_at = now
+        elif self.sla_stage is None:
+            self.sla_stage = 'first_response' if (self.status or 'Open') == 'Open' else 'resolution'
+            self.sla_started_at = self.created_at or now
+        elif self.sla_stage == 'first_response' and self.status != 'Open':
+            self.sla_stage = 'resolution'
+        policy = SLA_POLICIES.get(self.priority, SLA_POLICIES['Medium'])
+        self.sla_due_at = self.sla_started_at + policy[self.sla_stage]
+
+    def get_sla_escalation(self, now):
+        # Column values for a breached ticket: a missed first response moves on to the
+        # resolution SLA, a missed resolution bumps the priority and stops the clock.
+        # A first response missed after the resolution deadline counts as both at once.
+        if self.sla_stage == 'first_response':
+            policy = SLA_POLICIES.get(self.priority, SLA_POLICIES['Medium'])
+            resolution_due_at = self.sla_started_at + policy['resolution']
+            if resolution_due_at > now:
+                return {
+                    'sla_stage': 'resolution',
+                    'sla_due_at': resolution_due_at,
+                    'priority': self.priority
+                }
+        return {
+            'sla_stage': 'breached',
+            'sla_due_at': None,
+            'priority': PRIORITY_ESCALATION.get(self.priority, self.priority)
+        }
+
 class IntegrationSetting(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     integration_name = db.Column(db.String(50), nullable=False, unique=True)
@@ -132,6 +194,208 @@ New Ticket Created:
         except requests.exceptions.RequestException as e:
             logger.error(f"Error sending Slack notification for ticket #{ticket.id}: {e}")
 
+def send_sla_escalation_notification(escalations):
+    slack_webhook_url = get_slack_webhook_url()
+    if not slack_webhook_url:
+        logger.warning("Slack integration is not enabled or webhook URL is not set.")
+        return
+
+    lines = []
+    for ticket_id, title, stage, due_at, priority in escalations:
+        stage_name = 'First response' if stage == 'first_response' else 'Resolution'
+        lines.append(f"*#{ticket_id}: {title}* - {stage_name} SLA breached "
+                     f"(due {due_at.strftime('%m/%d/%Y %I:%M %p')} UTC), priority {priority}")
+    payload = {
+        'text': f'SLA breached on {len(escalations)} ticket(s)',
+        'attachments': [
+            {
+                'color': '#d9534f',
+                'text': '\n'.join(lines)
+            }
+        ]
+    }
+    try:
+        response = requests.post(slack_webhook_url, json=payload, timeout=SLACK_TIMEOUT)
+        response.raise_for_status()
+        logger.info(f"Slack SLA escalation sent for {len(escalations)} ticket(s)")
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Error sending Slack SLA escalation: {e}")
+
+class SLAScheduler:
+    """Escalates breached SLAs from an in-memory min-heap of ticket deadlines.
+
+    Only deadlines that fall inside the current load window are kept in memory.
+    They are read from the indexed ``ticket.sla_due_at`` column one window at a
+    time, which also recovers pending timers after a restart without scanning
+    the whole ticket table. Heap entries are never removed in place; an entry is
+    stale once ``_deadlines`` no longer maps its ticket to the same due time.
+
+    Escalations are conditional updates on the stage and deadline that were
+    read, so a concurrent edit or another worker's scheduler always wins.
+    """
+
+    def __init__(self, app, batch_size=SLA_BATCH_SIZE, load_window=SLA_LOAD_WINDOW, clock=datetime.utcnow):
+        self.app = app
+        self.batch_size = batch_size
+        self.load_window = load_window
+        self.clock = clock
+        self._heap = []
+        self._deadlines = {}  # ticket id -> due time of its live heap entry
+        self._loaded_until = None  # Deadlines before this are in memory
+        self._loading_until = None  # End of the window being queried, if a load is running
+        self._next_load_at = None  # When to load the next window, or retry a failed load
+        self._wakeup = threading.Condition()
+        self._thread = None
+
+    def start(self):
+        with self._wakeup:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='sla-scheduler', daemon=True)
+            self._thread.start()
+        logger.info("SLA scheduler started")
+
+    def schedule(self, ticket_id, due_at):
+        # Replace any pending timer for the ticket; call after the change is committed
+        with self._wakeup:
+            self._deadlines.pop(ticket_id, None)
+            limit = self._loading_until or self._loaded_until
+            if due_at is None or limit is None or due_at >= limit:
+                return  # Picked up from the database when its window is loaded
+            self._push(ticket_id, due_at)
+
+    def _push(self, ticket_id, due_at):
+        # Add a timer regardless of the load window; caller holds self._wakeup
+        self._deadlines[ticket_id] = due_at
+        heapq.heappush(self._heap, (due_at, ticket_id))
+        self._wakeup.notify()
+
+    def _run(self):
+        while True:
+            try:
+                self._load_window()
+            except Exception as e:
+                logger.error(f"Error loading SLA deadlines: {str(e)}")
+                logger.error(f"Traceback: {traceback.format_exc()}")
+            try:
+                batch = self._pop_due()
+                if batch:
+                    self._fire(batch)
+                    continue
+            except Exception as e:
+                logger.error(f"Error in SLA scheduler: {str(e)}")
+                logger.error(f"Traceback: {traceback.format_exc()}")
+            self._wait()
+
+    def _load_window(self):
+        now = self.clock()
+        with self._wakeup:
+            if self._next_load_at is not None and now < self._next_load_at:
+                return
+            window_start = self._loaded_until
+            window_end = now + self.load_window
+            # Timers committed while the query runs are pushed directly by schedule()
+            self._loading_until = window_end
+
+        try:
+            with self.app.app_context():
+                query = db.session.query(Ticket.id, Ticket.sla_due_at).filter(Ticket.sla_due_at < window_end)
+                if window_start is not None:
+                    query = query.filter(Ticket.sla_due_at >= window_start)
+                rows = query.all()
+        except Exception:
+            with self._wakeup:
+                # Keep the old window so the same range is queried again on retry
+                self._loading_until = None
+                self._next_load_at = now + SLA_RETRY_DELAY
+            raise
+
+        with self._wakeup:
+            for ticket_id, due_at in rows:
+                if ticket_id not in self._deadlines:
+                    self._push(ticket_id, due_at)
+            self._loaded_until = window_end
+            self._loading_until = None
+            self._next_load_at = window_end
+        logger.debug(f"Loaded {len(rows)} SLA deadline(s) due before {window_end.isoformat()}")
+
+    def _pop_due(self):
+        now = self.clock()
+        batch = []
+        with self._wakeup:
+            while self._heap and self._heap[0][0] <= now and len(batch) < self.batch_size:
+                due_at, ticket_id = heapq.heappop(self._heap)
+                if self._deadlines.get(ticket_id) != due_at:
+                    continue  # Rescheduled or cancelled since it was pushed
+                del self._deadlines[ticket_id]
+                batch.append(ticket_id)
+        return batch
+
+    def _wait(self):
+        with self._wakeup:
+            next_at = self._next_load_at or self.clock()
+            if self._heap:
+                next_at = min(next_at, self._heap[0][0])
+            timeout = (next_at - self.clock()).total_seconds()
+            if timeout > 0:
+                self._wakeup.wait(timeout)
+
+    def _fire(self, ticket_ids):
+        with self.app.app_context():
+            try:
+                now = self.clock()
+                breached = []
+                pending = []
+                skipped = []
+                tickets = Ticket.query.filter(Ticket.id.in_(ticket_ids)).all()
+                for ticket in tickets:
+                    # The database is authoritative; the heap entry may be out of date
+                    if ticket.sla_due_at is None or ticket.sla_due_at > now:
+                        pending.append((ticket.id, ticket.sla_due_at))
+                        continue
+                    escalation = ticket.get_sla_escalation(now)
+                    updated = Ticket.query.filter_by(
+                        id=ticket.id,
+                        sla_stage=ticket.sla_stage,
+                        sla_due_at=ticket.sla_due_at,
+                        priority=ticket.priority
+                    ).update(escalation, synchronize_session=False)
+                    if updated:
+                        breached.append((ticket.id, ticket.title, ticket.sla_stage, ticket.sla_due_at,
+                                         escalation['priority']))
+                        pending.append((ticket.id, escalation['sla_due_at']))
+                    else:
+                        skipped.append(ticket.id)
+                db.session.commit()
+                if skipped:
+                    # Changed by an edit or another scheduler since it was read; track the new deadline
+                    logger.debug(f"Skipped SLA escalation for modified tickets {skipped}")
+                    pending.extend(db.session.query(Ticket.id, Ticket.sla_due_at)
+                                   .filter(Ticket.id.in_(skipped)).all())
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Error escalating SLAs for tickets {ticket_ids}: {str(e)}")
+                logger.error(f"Traceback: {traceback.format_exc()}")
+                # The database still holds the overdue deadlines, so the retry must not
+                # depend on a window query picking them up again
+                retry_at = self.clock() + SLA_RETRY_DELAY
+                with self._wakeup:
+                    for ticket_id in ticket_ids:
+                        self._push(ticket_id, retry_at)
+                return
+
+            for ticket_id, due_at in pending:
+                self.schedule(ticket_id, due_at)
+            if breached:
+                logger.info(f"SLA breached for tickets {[b[0] for b in breached]}")
+                send_sla_escalation_notification(breached)
+
+sla_scheduler = SLAScheduler(app)
+
+@app.before_first_request
+def start_sla_scheduler():
+    sla_scheduler.start()
+
 def create_jira_issue(ticket):
     jira_settings = get_jira_settings()
     if not jira_settings:
@@ -181,8 +445,10 @@ def new_ticket():
                 requester_name=request.form['requester_name'],
                 requester_email=request.form['requester_email']
             )
+            new_ticket.update_sla()
             db.session.add(new_ticket)
             db.session.commit()
+            sla_scheduler.schedule(new_ticket.id, new_ticket.sla_due_at)
             logger.info(f"Ticket committed to database: #{new_ticket.id}")
 
             # Send Slack notification
@@ -237,7 +503,9 @@ def edit_ticket(id):
         ticket.assigned_to = request.form['assigned_to']
         ticket.requester_name = request.form['requester_name']
         ticket.requester_email = request.form['requester_email']
+        ticket.update_sla()
         db.session.commit()
+        sla_scheduler.schedule(ticket.id, ticket.sla_due_at)
         flash('Ticket updated successfully.', 'success')
         return redirect(url_for('tickets'))
     return render_template('edit_ticket.html', ticket=ticket)
@@ -246,7 +514,9 @@ def edit_ticket(id):
 def delete_ticket(id):
     ticket = Ticket.query.get_or_404(id)
     ticket.deleted = True
+    ticket.update_sla()
     db.session.commit()
+    sla_scheduler.schedule(ticket.id, ticket.sla_due_at)
     flash('Ticket deleted successfully.', 'success')
     return redirect(url_for('tickets'))
 
@@ -329,8 +599,10 @@ def submit_ticket():
                 priority='Medium',
                 category='Support'
             )
+            new_ticket.update_sla()
             db.session.add(new_ticket)
             db.session.commit()
+            sla_scheduler.schedule(new_ticket.id, new_ticket.sla_due_at)
             
             # Send Slack notification
             send_slack_notification(new_ticket)
@@ -351,4 +623,7 @@ def submit_ticket():
     return render_template('submit_ticket.html')
 
 if __name__ == '__main__':
+    # Start SLA timers right away in the serving process rather than the reloader parent
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        sla_scheduler.start()
     app.run(debug=True)
\ No newline at end of file
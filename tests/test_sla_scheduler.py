@@ -0,0 +1,273 @@
+import importlib.util
+import os
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+import app as helpdesk
+from app import app, db, Ticket, SLAScheduler, SLA_POLICIES, SLA_LOAD_WINDOW, SLA_RETRY_DELAY
+
+
+class FakeClock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, delta):
+        self.now += delta
+
+
+def load_sla_migration():
+    path = os.path.join(os.path.dirname(helpdesk.__file__), 'migrations', 'versions',
+                        '8a1f2c6d9e34_add_sla_columns_to_ticket_model.py')
+    spec = importlib.util.spec_from_file_location('sla_migration', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def database_locked(*args, **kwargs):
+    raise OperationalError('SELECT', {}, Exception('database is locked'))
+
+
+@pytest.fixture
+def clock():
+    return FakeClock(datetime(2024, 8, 20, 9, 0))
+
+
+@pytest.fixture
+def alerts(monkeypatch):
+    sent = []
+    monkeypatch.setattr(helpdesk, 'send_sla_escalation_notification', sent.extend)
+    return sent
+
+
+@pytest.fixture
+def scheduler(clock, alerts, monkeypatch):
+    monkeypatch.setitem(app.config, 'SQLALCHEMY_DATABASE_URI', 'sqlite://')
+    with app.app_context():
+        db.create_all()
+    yield SLAScheduler(app, clock=clock)
+    with app.app_context():
+        db.drop_all()
+
+
+def add_ticket(clock, created_at=None, status='Open', priority='Medium'):
+    with app.app_context():
+        ticket = Ticket(title='Printer on fire', description='Help', status=status, priority=priority,
+                        requester_name='Pat', requester_email='pat@example.com',
+                        created_at=created_at or clock())
+        ticket.update_sla(clock())
+        db.session.add(ticket)
+        db.session.commit()
+        return ticket.id
+
+
+def edit_ticket(scheduler, clock, ticket_id, **changes):
+    # Same steps as the edit_ticket view
+    with app.app_context():
+        ticket = Ticket.query.get(ticket_id)
+        for name, value in changes.items():
+            setattr(ticket, name, value)
+        ticket.update_sla(clock())
+        db.session.commit()
+        scheduler.schedule(ticket.id, ticket.sla_due_at)
+        return ticket.sla_due_at
+
+
+def get_ticket(ticket_id):
+    with app.app_context():
+        ticket = Ticket.query.get(ticket_id)
+        return ticket.sla_stage, ticket.sla_due_at, ticket.priority
+
+
+def test_failed_load_is_retried(scheduler, clock, monkeypatch):
+    scheduler._load_window()
+    first_window_end = scheduler._loaded_until
+    # Due early in the second window
+    ticket_id = add_ticket(clock, created_at=first_window_end + timedelta(minutes=5) - SLA_POLICIES['Medium']['first_response'])
+
+    clock.advance(SLA_LOAD_WINDOW)
+    with monkeypatch.context() as patch:
+        patch.setattr(db.session, 'query', database_locked)
+        with pytest.raises(OperationalError):
+            scheduler._load_window()
+    assert scheduler._loaded_until == first_window_end
+
+    scheduler._load_window()  # Backing off, not queried yet
+    assert ticket_id not in scheduler._deadlines
+
+    clock.advance(SLA_RETRY_DELAY)
+    scheduler._load_window()
+    assert ticket_id in scheduler._deadlines
+    clock.advance(timedelta(minutes=5))
+    assert scheduler._pop_due() == [ticket_id]
+
+
+def test_failed_initial_load_is_retried(scheduler, clock, monkeypatch):
+    ticket_id = add_ticket(clock, created_at=clock() - timedelta(days=1))
+
+    with monkeypatch.context() as patch:
+        patch.setattr(db.session, 'query', database_locked)
+        with pytest.raises(OperationalError):
+            scheduler._load_window()
+    assert scheduler._loaded_until is None
+
+    clock.advance(SLA_RETRY_DELAY)
+    scheduler._load_window()
+    assert scheduler._pop_due() == [ticket_id]
+
+
+def test_failed_escalation_is_retried_across_window_boundary(scheduler, clock, alerts, monkeypatch):
+    scheduler._load_window()
+    due_at = scheduler._loaded_until - timedelta(seconds=40)
+    ticket_id = add_ticket(clock, created_at=due_at - SLA_POLICIES['Medium']['first_response'])
+    scheduler.schedule(ticket_id, due_at)
+
+    clock.advance(SLA_LOAD_WINDOW - timedelta(seconds=30))
+    with monkeypatch.context() as patch:
+        patch.setattr(db.session, 'commit', database_locked)
+        scheduler._fire(scheduler._pop_due())
+    assert scheduler._deadlines[ticket_id] >= scheduler._loaded_until
+
+    clock.advance(SLA_RETRY_DELAY)
+    scheduler._load_window()
+    scheduler._fire(scheduler._pop_due())
+    assert get_ticket(ticket_id)[0] == 'resolution'
+    assert [alert[0] for alert in alerts] == [ticket_id]
+
+
+def test_edit_reschedules_and_close_cancels(scheduler, clock):
+    ticket_id = add_ticket(clock, created_at=clock() - timedelta(minutes=10), priority='Low')
+    scheduler._load_window()
+    assert ticket_id not in scheduler._deadlines  # Low first response is a day out
+
+    urgent_due_at = edit_ticket(scheduler, clock, ticket_id, priority='Urgent')
+    assert scheduler._deadlines[ticket_id] == urgent_due_at
+
+    medium_due_at = edit_ticket(scheduler, clock, ticket_id, priority='Medium')
+    assert ticket_id not in scheduler._deadlines
+    assert medium_due_at >= scheduler._loaded_until
+
+    edit_ticket(scheduler, clock, ticket_id, priority='Urgent')
+    edit_ticket(scheduler, clock, ticket_id, status='Closed')
+    assert ticket_id not in scheduler._deadlines
+    clock.advance(SLA_LOAD_WINDOW)
+    assert scheduler._pop_due() == []
+
+
+def test_restart_recovers_pending_deadlines(scheduler, clock):
+    overdue_id = add_ticket(clock, created_at=clock() - timedelta(days=1))
+    soon_id = add_ticket(clock, created_at=clock() - timedelta(minutes=10), priority='Urgent')
+    later_id = add_ticket(clock, priority='Low')
+
+    restarted = SLAScheduler(app, clock=clock)
+    restarted._load_window()
+    assert set(restarted._deadlines) == {overdue_id, soon_id}
+    assert restarted._pop_due() == [overdue_id]
+
+    clock.advance(SLA_LOAD_WINDOW)
+    restarted._load_window()
+    assert restarted._pop_due() == [soon_id]
+    assert later_id not in restarted._deadlines
+
+    clock.advance(SLA_POLICIES['Low']['first_response'] - SLA_LOAD_WINDOW)
+    restarted._load_window()
+    assert restarted._pop_due() == [later_id]
+
+
+def test_escalation_skips_ticket_closed_after_read(scheduler, clock, alerts, monkeypatch):
+    ticket_id = add_ticket(clock, created_at=clock() - timedelta(days=1))
+    scheduler._load_window()
+    batch = scheduler._pop_due()
+
+    # Close the ticket between the scheduler's read and its write
+    query_class = Ticket.query.__class__
+    query_all = query_class.all
+    reads = []
+    def close_after_first_read(query):
+        rows = query_all(query)
+        reads.append(rows)
+        if len(reads) == 1:
+            db.session.execute(Ticket.__table__.update().values(status='Closed', sla_stage='closed', sla_due_at=None))
+        return rows
+
+    scheduled = []
+    schedule = scheduler.schedule
+    def record_schedule(ticket_id, due_at):
+        scheduled.append((ticket_id, due_at))
+        schedule(ticket_id, due_at)
+
+    with monkeypatch.context() as patch:
+        patch.setattr(query_class, 'all', close_after_first_read)
+        patch.setattr(scheduler, 'schedule', record_schedule)
+        scheduler._fire(batch)
+    assert len(reads) == 2
+    assert reads[1] == [(ticket_id, None)]  # Re-read of the skipped ticket sees the close
+    assert scheduled == [(ticket_id, None)]
+    assert get_ticket(ticket_id)[:2] == ('closed', None)
+    assert alerts == []
+    assert ticket_id not in scheduler._deadlines
+
+
+def test_two_schedulers_escalate_once(scheduler, clock, alerts):
+    ticket_id = add_ticket(clock, status='In Progress', created_at=clock() - timedelta(days=4))
+    other = SLAScheduler(app, clock=clock)
+    scheduler._load_window()
+    other._load_window()
+
+    scheduler._fire(scheduler._pop_due())
+    other._fire(other._pop_due())
+    assert get_ticket(ticket_id) == ('breached', None, 'High')
+    assert len(alerts) == 1
+
+
+def test_reopen_starts_fresh_resolution_clock(scheduler, clock):
+    ticket_id = add_ticket(clock, created_at=clock() - timedelta(days=30))
+    edit_ticket(scheduler, clock, ticket_id, status='Closed')
+    due_at = edit_ticket(scheduler, clock, ticket_id, status='Open')
+    assert get_ticket(ticket_id)[0] == 'resolution'
+    assert due_at == clock() + SLA_POLICIES['Medium']['resolution']
+
+
+def test_reopen_keeps_breached_ticket_stopped(scheduler, clock, alerts):
+    ticket_id = add_ticket(clock, status='In Progress', created_at=clock() - timedelta(days=4))
+    scheduler._load_window()
+    scheduler._fire(scheduler._pop_due())
+    edit_ticket(scheduler, clock, ticket_id, status='Closed')
+    edit_ticket(scheduler, clock, ticket_id, status='Open')
+    assert get_ticket(ticket_id) == ('breached', None, 'High')
+    assert len(alerts) == 1
+
+
+def test_missed_first_response_past_resolution_escalates_once(scheduler, clock, alerts):
+    ticket_id = add_ticket(clock, priority='Medium', created_at=clock() - timedelta(days=4))
+    scheduler._load_window()
+    scheduler._fire(scheduler._pop_due())
+    assert get_ticket(ticket_id) == ('breached', None, 'High')
+
+    clock.advance(SLA_RETRY_DELAY)
+    scheduler._load_window()
+    assert scheduler._pop_due() == []
+    assert len(alerts) == 1
+
+
+def test_backfilled_tickets_are_not_escalated(scheduler, clock, alerts):
+    with app.app_context():
+        for status, priority in [('Open', 'High'), ('In Progress', 'Urgent'), ('Closed', 'Low')]:
+            db.session.add(Ticket(title='Legacy', description='Old', status=status, priority=priority,
+                                  requester_name='Pat', requester_email='pat@example.com',
+                                  created_at=datetime(2024, 1, 2, 9, 0)))
+        db.session.commit()
+        load_sla_migration().backfill_sla(db.session.connection(), clock())
+        db.session.commit()
+
+    scheduler._load_window()
+    scheduler._fire(scheduler._pop_due())
+    assert alerts == []
+    assert get_ticket(1) == ('first_response', clock() + SLA_POLICIES['High']['first_response'], 'High')
+    assert get_ticket(2) == ('resolution', clock() + SLA_POLICIES['Urgent']['resolution'], 'Urgent')
+    assert get_ticket(3) == ('closed', None, 'Low')